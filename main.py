@@ -10,7 +10,7 @@ from rlview import rli_file
 def main():
 
     file = rli_file.RLIFile('data/РЛС-А100-аэропорт.rl4')
-    file.add('data/РЛС-А200-аэропорт.rl4')
+    file.add('data/РЛС-А200-аэропорт.rl4', align=True)
     
     img = file.toimg()
     plt.imshow(img, cmap='gray')
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import sys
+
+from rlview import enhance, render
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m rlview')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    render.add_parser(subparsers)
+    enhance.add_parser(subparsers)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
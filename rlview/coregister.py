@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+"""Co-registration and change detection of two acquisitions"""
+
+import math
+
+import numpy as np
+import skimage.transform
+
+
+def phase_correlation(ref, mov):
+    """Sub-pixel shift (dy, dx) of mov relative to ref
+
+    mov(y, x) ~ ref(y - dy, x - dx). The shift is found as the peak of the
+    normalized cross-power spectrum and refined by a parabolic fit.
+    """
+
+    window = np.outer(np.hanning(ref.shape[0]), np.hanning(ref.shape[1]))
+
+    f_ref = np.fft.rfft2((ref - ref.mean()) * window)
+    f_mov = np.fft.rfft2((mov - mov.mean()) * window)
+
+    spectrum = f_mov * np.conj(f_ref)
+    spectrum /= np.maximum(np.abs(spectrum), np.finfo(float).tiny)
+    corr = np.fft.irfft2(spectrum, s=ref.shape)
+
+    peak = np.unravel_index(np.argmax(corr), corr.shape)
+    shift = []
+
+    for axis, size in enumerate(corr.shape):
+        lo = list(peak)
+        lo[axis] = (peak[axis] - 1) % size
+        hi = list(peak)
+        hi[axis] = (peak[axis] + 1) % size
+
+        c_prev, c_peak, c_next = corr[tuple(lo)], corr[peak], corr[tuple(hi)]
+        denom = c_prev - 2 * c_peak + c_next
+        offset = 0.5 * (c_prev - c_next) / denom if denom != 0 else 0.0
+
+        value = peak[axis] + offset
+        if value > size / 2:
+            value -= size
+        shift.append(value)
+
+    return np.array(shift)
+
+
+def pyramid(img, min_size=64):
+    """Image decimated by 2 until the smaller side drops below min_size
+
+    Level 0 is the image itself.
+    """
+
+    levels = [img]
+    while min(levels[-1].shape) // 2 >= min_size:
+        levels.append(skimage.transform.downscale_local_mean(levels[-1], (2, 2)))
+    return levels
+
+
+def _snap(shift, eps=1e-6):
+    """Round shift components within eps of whole pixels, which are estimation noise"""
+
+    shift = np.asarray(shift, dtype=float)
+    rounded = np.round(shift)
+    return np.where(np.abs(shift - rounded) < eps, rounded, shift)
+
+
+def translate(img, shift, cval=0.0):
+    """Resample img so that a shift (dy, dx) found by phase_correlation is undone"""
+
+    dy, dx = _snap(shift)
+    transform = skimage.transform.AffineTransform(translation=(dx, dy))
+    return skimage.transform.warp(img, transform, order=1, mode='constant',
+                                  cval=cval, preserve_range=True)
+
+
+def estimate_shift(ref, mov, min_size=64):
+    """Shift (dy, dx) of mov relative to ref, estimated coarse-to-fine
+
+    The shift is found on the coarsest level of the pyramids and refined on
+    every finer level after compensating the estimate so far, so each
+    correlation only has to resolve a residual of about a pixel.
+    """
+
+    ref_levels = pyramid(ref, min_size)
+    mov_levels = pyramid(mov, min_size)
+    shift = np.zeros(2)
+
+    for ref_level, mov_level in zip(reversed(ref_levels), reversed(mov_levels)):
+        shift *= 2
+        if shift.any():
+            mov_level = translate(mov_level, shift, cval=mov_level.mean())
+        shift += phase_correlation(ref_level, mov_level)
+
+    return shift
+
+
+def align(ref, mov, min_size=64, cval=0.0):
+    """Resample mov onto ref, returns the aligned image and the shift
+
+    Both images are cropped to their common size first.
+    """
+
+    height = min(ref.shape[0], mov.shape[0])
+    width = min(ref.shape[1], mov.shape[1])
+    ref = ref[:height, :width]
+    mov = mov[:height, :width]
+
+    shift = estimate_shift(ref, mov, min_size)
+    return translate(mov, shift, cval), shift
+
+
+def overlap(shape, shift):
+    """Slices of the points of an image translated by shift that have data
+
+    Outside of them translate() only has the fill value.
+    """
+
+    window = []
+    for size, d in zip(shape, _snap(shift)):
+        start = math.ceil(max(0.0, -d))
+        stop = math.floor(min(size - 1, size - 1 - d)) + 1
+        window.append(slice(start, max(start, stop)))
+    return tuple(window)
+
+
+def log_ratio(ref, other, block=8, eps=1e-6):
+    """Log-ratio change map of two aligned amplitude images
+
+    Each point of the map is log(mean(other) / mean(ref)) over a
+    block x block window. Rows of blocks are processed one at a time,
+    so the inputs may be memory mapped. Blocks with no data (NaN) stay NaN.
+    """
+
+    height = min(ref.shape[0], other.shape[0]) // block
+    width = min(ref.shape[1], other.shape[1]) // block
+    result = np.empty((height, width))
+
+    for i in range(height):
+        rows = slice(i * block, (i + 1) * block)
+        a = np.asarray(ref[rows, :width * block], dtype=float)
+        b = np.asarray(other[rows, :width * block], dtype=float)
+        a = a.reshape(block, width, block).mean(axis=(0, 2))
+        b = b.reshape(block, width, block).mean(axis=(0, 2))
+        result[i] = np.log((b + eps) / (a + eps))
+
+    return result
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+
+"""Image enhancement for toimg() and its tuning against a reference render"""
+
+import concurrent.futures
+import itertools
+import json
+import math
+
+import numpy as np
+import skimage.color
+import skimage.exposure
+import skimage.io
+import skimage.metrics
+import skimage.transform
+from skimage.util.dtype import img_as_float
+
+
+# Contrast stretching matching RLView.exe closely enough by eye
+DEFAULT_ENHANCEMENT = {'method': 'stretch', 'p_start': 0.1, 'p_end': 98.7, 'gamma': 1.0}
+
+STRETCH_P_START = (0.0, 0.1, 0.5, 1.0, 2.0, 5.0)
+STRETCH_P_END = (90.0, 95.0, 97.0, 98.0, 98.7, 99.0, 99.5, 99.9, 100.0)
+GAMMAS = (0.4, 0.5, 0.6, 0.7, 0.85, 1.0, 1.2, 1.5)
+
+
+def cumulative_histogram(data, bins=4096):
+    """Bin centers and CDF of the data
+
+    Bins are uniform in log(1 + x - min), so the heavy tail of the amplitudes
+    does not squeeze the bulk of the points into the first bins.
+    """
+
+    offset = data.min()
+    scaled = np.log1p(data - offset)
+    top = scaled.max() or 1.0
+
+    hist, edges = np.histogram(scaled, bins=bins, range=(0, top))
+    cdf = (np.cumsum(hist) - hist / 2) / hist.sum()
+    centers = np.expm1((edges[:-1] + edges[1:]) / 2) + offset
+
+    return centers, cdf
+
+
+def lut(params, values, cdf):
+    """Enhancement params evaluated at values, cdf is the data CDF at values"""
+
+    if params['method'] == 'equalize':
+        out = cdf.copy()
+    elif params['method'] == 'stretch':
+        p_start, p_end = np.interp((params['p_start'] / 100, params['p_end'] / 100), cdf, values)
+        out = np.clip((values - p_start) / max(p_end - p_start, np.finfo(float).tiny), 0, 1)
+    else:
+        raise ValueError(f'Unknown enhancement method: {params["method"]}')
+
+    gamma = params.get('gamma', 1.0)
+    return out if gamma == 1.0 else out ** gamma
+
+
+def enhance(img, params=None):
+    """Apply enhancement params to a float image, see DEFAULT_ENHANCEMENT"""
+
+    params = params or DEFAULT_ENHANCEMENT
+
+    if params['method'] == 'stretch':
+        p_start, p_end = np.percentile(img, (params['p_start'], params['p_end']))
+        img = skimage.exposure.rescale_intensity(img, in_range=(p_start, p_end))
+    elif params['method'] == 'equalize':
+        values, cdf = cumulative_histogram(img)
+        img = np.interp(img, values, cdf)
+    else:
+        raise ValueError(f'Unknown enhancement method: {params["method"]}')
+
+    gamma = params.get('gamma', 1.0)
+    return img if gamma == 1.0 else np.clip(img, 0, 1) ** gamma
+
+
+def block_mean(img, factor):
+    """Image shrunk by factor, each point the mean of its factor x factor block
+
+    Unlike downscale_local_mean alone, partial blocks on the bottom/right
+    edge are averaged over their own points, not padded with zeros.
+    """
+
+    total = skimage.transform.downscale_local_mean(img, (factor, factor))
+    coverage = skimage.transform.downscale_local_mean(np.ones(img.shape[:2]), (factor, factor))
+    return total / coverage
+
+
+def candidates():
+    """Enhancement params tried by the tuner"""
+
+    for p_start, p_end, gamma in itertools.product(STRETCH_P_START, STRETCH_P_END, GAMMAS):
+        yield {'method': 'stretch', 'p_start': p_start, 'p_end': p_end, 'gamma': gamma}
+
+    for gamma in GAMMAS:
+        yield {'method': 'equalize', 'gamma': gamma}
+
+
+def load_reference(path):
+    """Reference render as a grayscale float image"""
+
+    img = skimage.io.imread(path)
+    if img.ndim == 3:
+        img = skimage.color.rgb2gray(img[..., :3])
+    return img_as_float(img)
+
+
+class Tuner():
+    """Scores enhancement params on a downsampled proxy of the scene
+
+    The histogram is computed once. Every proxy point is the mean of a
+    factor x factor block, so it is kept as the list of (bin, count) pairs
+    of its block: a candidate costs one LUT lookup per pair instead of a
+    pass over the full image.
+    """
+
+    def __init__(self, data, reference, proxy_size=256, bins=4096):
+        height = min(data.shape[0], reference.shape[0])
+        width = min(data.shape[1], reference.shape[1])
+        data = data[:height, :width]
+
+        self.factor = max(1, math.ceil(max(height, width) / proxy_size))
+        self.values, self.cdf = cumulative_histogram(data, bins)
+
+        self.reference = block_mean(reference[:height, :width], self.factor)
+        self.shape = self.reference.shape
+
+        # Bin of every point and the proxy point its block maps to
+        offset = data.min()
+        scaled = np.log1p(data - offset)
+        top = scaled.max() or 1.0
+        bin_index = np.minimum((scaled / top * bins).astype(np.int64), bins - 1)
+
+        rows = np.arange(height) // self.factor
+        cols = np.arange(width) // self.factor
+        block_index = rows[:, None] * self.shape[1] + cols[None, :]
+
+        pairs, counts = np.unique((block_index * bins + bin_index).ravel(), return_counts=True)
+        self._blocks = pairs // bins
+        self._bins = pairs % bins
+
+        # Blocks on the right/bottom edge may be partial, average per block
+        block_size = np.bincount(self._blocks, weights=counts, minlength=self.reference.size)
+        self._weights = counts / block_size[self._blocks]
+
+    def render(self, params):
+        """Proxy image for params"""
+
+        table = lut(params, self.values, self.cdf)
+        proxy = np.bincount(self._blocks, weights=self._weights * table[self._bins],
+                            minlength=self.reference.size)
+        return proxy.reshape(self.shape)
+
+    def score(self, params):
+        """Similarity of the proxy image to the reference, higher is better"""
+
+        return skimage.metrics.structural_similarity(self.render(params), self.reference,
+                                                     data_range=1.0)
+
+
+_tuner = None
+
+def _init_worker(tuner):
+    global _tuner
+    _tuner = tuner
+
+def _score(params):
+    return _tuner.score(params)
+
+
+def tune(file, reference, workers=None, proxy_size=256):
+    """Find enhancement params making file.toimg() look like the reference
+
+    reference is an image path or array. The best params are stored in
+    file.enhancement and returned with their score.
+    """
+
+    if isinstance(reference, str):
+        reference = load_reference(reference)
+
+    tuner = Tuner(file.data, reference, proxy_size)
+    params = list(candidates())
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                initializer=_init_worker,
+                                                initargs=(tuner,)) as pool:
+        scores = list(pool.map(_score, params, chunksize=16))
+
+    best = int(np.argmax(scores))
+    file.enhancement = params[best]
+
+    return params[best], scores[best]
+
+
+def save_params(path, params):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(params, f, indent=2)
+
+def load_params(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def add_parser(subparsers):
+    """Register the tune command"""
+
+    parser = subparsers.add_parser('tune', help='tune enhancement to match a reference render')
+    parser.add_argument('source', help='RLI file')
+    parser.add_argument('reference', help='reference image, e.g. a RLView.exe screenshot')
+    parser.add_argument('-o', '--output', default='enhancement.json', help='params file to write')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='number of worker processes')
+    parser.set_defaults(func=_main)
+
+
+def _main(args):
+    # rli_file imports this module
+    from rlview import rli_file
+
+    params, score = tune(rli_file.RLIFile(args.source), args.reference, args.jobs)
+    print(f'Best: {params}, SSIM {score:.4f}')
+    save_params(args.output, params)
+    return 0
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+"""Incremental reading of RLI files that are still being written"""
+
+import asyncio
+import ctypes
+import io
+import time
+
+import numpy as np
+
+from rlview import rli_file
+
+
+class RunningStats():
+    """Amplitude statistics updated with every new block of lines
+
+    Blocks are merged by their mean and sum of squared deviations (Chan et
+    al.), a plain sum of squares loses the variance for amplitudes ~1e12.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self.mean = np.nan
+        self._m2 = 0.0
+
+    def update(self, data):
+        if not data.size:
+            return
+
+        count = data.size
+        mean = data.mean(dtype=float)
+        m2 = np.square(data - mean, dtype=float).sum()
+
+        if not self.count:
+            self.mean, self._m2 = mean, m2
+        else:
+            total = self.count + count
+            delta = mean - self.mean
+            self.mean += delta * count / total
+            self._m2 += m2 + delta ** 2 * self.count * count / total
+
+        self.count += count
+        self.min = min(self.min, data.min())
+        self.max = max(self.max, data.max())
+
+    @property
+    def std(self):
+        return np.sqrt(self._m2 / self.count) if self.count else np.nan
+
+
+class FollowRLIFile(rli_file.RLIFile):
+    """RLI file that grows while it is being read
+
+    Each poll() decodes only the complete lines appended since the previous
+    one and updates the data, running statistics, quick-look (every step-th
+    line and point) and navigation table. Use follow() or aiter() to get
+    new lines as they arrive, or pass a callback called as
+    callback(file, first_line, data).
+    """
+
+    def __init__(self, file, step=8, callback=None, keep_data=True):
+        self.header = None
+        self.path = file
+
+        self.step = step
+        self.callback = callback
+        self.keep_data = keep_data
+
+        self.lines = 0
+        self.stats = RunningStats()
+        self.navigation = []
+
+        self._offset = ctypes.sizeof(rli_file.Header)
+        self._pending = b''
+        self._blocks = []
+        self._data = None
+        self._last = None
+        self._quicklook_blocks = []
+        self._quicklook = None
+
+    @property
+    def data(self):
+        """Lines read so far"""
+
+        if self._data is None:
+            width = self.width if self.header is not None else 0
+            self._data = np.vstack(self._blocks) if self._blocks else np.empty((0, width))
+            self._blocks = [self._data]
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+        self._blocks = [value]
+
+    @property
+    def quicklook(self):
+        """Decimated image of the lines read so far"""
+
+        if self._quicklook is None:
+            if self._quicklook_blocks:
+                self._quicklook = np.vstack(self._quicklook_blocks)
+                self._quicklook_blocks = [self._quicklook]
+            else:
+                self._quicklook = np.empty((0, 0))
+        return self._quicklook
+
+    @property
+    def complete(self):
+        """Whether all lines declared in the header are read"""
+        return self.header is not None and 0 < self.height <= self.lines
+
+    def _read_header(self, f):
+        f.seek(0, io.SEEK_SET)
+        buf = f.read(ctypes.sizeof(rli_file.Header))
+
+        if len(buf) < ctypes.sizeof(rli_file.Header):
+            return False
+
+        self.header = rli_file.Header.from_buffer_copy(buf)
+        return True
+
+    def poll(self):
+        """Decode lines appended since the last call, returns their count"""
+
+        if self.complete:
+            return 0
+
+        with open(self.path, 'rb') as f:
+            if self.header is None and not self._read_header(f):
+                return 0
+
+            f.seek(self._offset, io.SEEK_SET)
+            buf = self._pending + f.read()
+
+        self._offset += len(buf) - len(self._pending)
+        count = len(buf) // self.line_size
+
+        if self.height > 0:
+            # Anything past the declared lines (file tail) is not image data
+            count = min(count, self.height - self.lines)
+
+        self._pending = buf[count * self.line_size:]
+
+        if not count:
+            return 0
+
+        headers, data = self._decode_lines(buf[:count * self.line_size])
+        first = self.lines
+
+        self.stats.update(data)
+        self.navigation.extend(headers)
+
+        # Keep the decimation phase across blocks
+        start = -first % self.step
+        self._quicklook_blocks.append(data[start::self.step, ::self.step])
+        self._quicklook = None
+
+        if self.keep_data:
+            self._blocks.append(data)
+            self._data = None
+
+        self._last = data
+        self.lines += count
+
+        if self.complete:
+            self._pending = b''
+
+        if self.callback is not None:
+            self.callback(self, first, data)
+
+        return count
+
+    def _done(self, idle, timeout):
+        return self.complete or (timeout is not None and idle >= timeout)
+
+    def follow(self, interval=1.0, timeout=None):
+        """Yield (first_line, data) for new lines until the file is complete
+
+        Stops when all lines from the header are read or, if timeout is
+        given, when the file has not grown for timeout seconds.
+        """
+
+        last_change = time.monotonic()
+
+        while True:
+            first = self.lines
+            if self.poll():
+                last_change = time.monotonic()
+                yield first, self._last
+
+            if self._done(time.monotonic() - last_change, timeout):
+                return
+
+            time.sleep(interval)
+
+    async def aiter(self, interval=1.0, timeout=None):
+        """Asynchronous version of follow()"""
+
+        loop = asyncio.get_running_loop()
+        last_change = time.monotonic()
+
+        while True:
+            first = self.lines
+            if await loop.run_in_executor(None, self.poll):
+                last_change = time.monotonic()
+                yield first, self._last
+
+            if self._done(time.monotonic() - last_change, timeout):
+                return
+
+            await asyncio.sleep(interval)
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+
+"""Batch rendering of RLI files to images"""
+
+import concurrent.futures
+import ctypes
+import glob
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import skimage.io
+from skimage.util.dtype import img_as_ubyte
+
+from rlview import enhance, rli_file
+
+
+FORMATS = ('png', 'tiff')
+RLI_EXTENSIONS = ('.rl4', '.rl8')
+MANIFEST_NAME = 'rlview-render.json'
+
+# Peak memory while rendering in float64 copies of the image (about 4
+# measured: data, percentile copy, rescaled image and its clip), and while
+# decoding in copies of a raw chunk (read buffer, float32, float64, modulus)
+_RENDER_COPIES = 5
+_DECODE_COPIES = 5
+
+
+def _glob_root(pattern):
+    """Directory part of a glob pattern before the first wildcard"""
+
+    parts = []
+    for part in Path(pattern).parts:
+        if glob.has_magic(part):
+            break
+        parts.append(part)
+    return os.path.join(*parts) if parts else '.'
+
+
+def find_inputs(sources):
+    """Expand directories and glob patterns into a sorted list of RLI files
+
+    Returns (path, root) pairs, root is the directory the source was given
+    as (or the directory of a file or of the start of a glob pattern).
+    """
+
+    paths = {}
+
+    for source in sources:
+        if os.path.isdir(source):
+            found = [p for ext in RLI_EXTENSIONS
+                     for p in glob.glob(os.path.join(source, '**', f'*{ext}'), recursive=True)]
+            root = source
+        elif glob.has_magic(source):
+            found = glob.glob(source, recursive=True)
+            root = _glob_root(source)
+        elif os.path.isfile(source):
+            found = [source]
+            root = os.path.dirname(source)
+        else:
+            raise FileNotFoundError(source)
+
+        for path in found:
+            if os.path.isfile(path):
+                paths.setdefault(os.path.abspath(path), os.path.abspath(root))
+
+    return sorted(paths.items())
+
+
+def output_path(source, root, out_dir, fmt):
+    """Output image for source, mirroring its place under root"""
+
+    relative = Path(os.path.relpath(source, root)).with_suffix(f'.{fmt}')
+    return os.path.join(out_dir, relative)
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """SHA-1 of the file content"""
+
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def estimate_memory(path):
+    """Estimated peak memory in bytes needed to render the file
+
+    Only the scene data is counted, not the interpreter and libraries.
+    """
+
+    header = rli_file.read_header(path)
+    points = header.RLIFileParams.width * header.RLIFileParams.height
+    data_size = points * ctypes.sizeof(ctypes.c_double)
+    decode_size = min(rli_file.LOAD_CHUNK_SIZE, os.path.getsize(path)) * _DECODE_COPIES
+
+    return max(data_size * _RENDER_COPIES, data_size + decode_size)
+
+
+class Manifest():
+    """Job manifest stored next to the rendered images"""
+
+    def __init__(self, path):
+        self.path = path
+        self.jobs = {}
+
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.jobs = json.load(f).get('jobs', {})
+
+    def get(self, output):
+        return self.jobs.get(output)
+
+    def update(self, output, entry):
+        self.jobs[output] = entry
+        self.save()
+
+    def save(self):
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'jobs': self.jobs}, f, indent=2, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+
+def is_up_to_date(source, output, entry, options, check):
+    """Whether the output image for source can be reused
+
+    check is 'mtime' (output is newer than the source) or 'hash'
+    (source content is the same as for the recorded render).
+    """
+
+    if not os.path.exists(output):
+        return False
+
+    if entry is None:
+        # Rendered outside of the manifest, only the timestamps are known
+        return check == 'mtime' and os.path.getmtime(output) >= os.path.getmtime(source)
+
+    if entry.get('status') != 'done' or entry.get('options') != options:
+        return False
+
+    if check == 'hash':
+        return entry.get('sha1') == file_hash(source)
+
+    return os.path.getmtime(output) >= os.path.getmtime(source)
+
+
+def render_file(source, output, scale=1, budget=None, enhancement=None):
+    """Render one RLI file to an image, returns the number of bytes read"""
+
+    estimate = estimate_memory(source)
+    if budget and estimate > budget:
+        raise MemoryError(f'needs about {estimate / 2**20:.0f} MB to render, '
+                          f'over the {budget / 2**20:.0f} MB budget')
+
+    try:
+        img = rli_file.RLIFile(source).toimg(enhancement)
+
+        if scale > 1:
+            img = enhance.block_mean(img, scale)
+
+        img = img_as_ubyte(np.clip(img, 0, 1))
+    except MemoryError:
+        raise MemoryError(f'out of memory while rendering, '
+                          f'estimated {estimate / 2**20:.0f} MB') from None
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    tmp = f'{output}.tmp{Path(output).suffix}'
+    skimage.io.imsave(tmp, img, check_contrast=False)
+    os.replace(tmp, output)
+
+    return os.path.getsize(source)
+
+
+def render(sources, out_dir, fmt='png', scale=1, workers=None, budget=None, check='mtime',
+           enhancement=None):
+    """Render all RLI files found in sources into out_dir
+
+    Already rendered files are skipped, progress is kept in a manifest in
+    out_dir so an interrupted run resumes where it stopped.
+    Returns the number of failed files.
+    """
+
+    if fmt not in FORMATS:
+        raise ValueError(f'Unknown format: {fmt}')
+
+    enhancement = enhancement or enhance.DEFAULT_ENHANCEMENT
+    options = {'format': fmt, 'scale': scale, 'enhancement': enhancement}
+
+    outputs = {}
+    for source, root in find_inputs(sources):
+        output = output_path(source, root, out_dir, fmt)
+
+        if output in outputs:
+            raise ValueError(f'{outputs[output]} and {source} would both be rendered to {output}')
+        outputs[output] = source
+
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = Manifest(os.path.join(out_dir, MANIFEST_NAME))
+
+    jobs = []
+    for output, source in outputs.items():
+        if is_up_to_date(source, output, manifest.get(output), options, check):
+            print(f'Up to date: {source}')
+            continue
+
+        jobs.append((source, output))
+
+    print(f'Render {len(jobs)} files with {workers or os.cpu_count()} workers')
+
+    done = 0
+    failed = 0
+    total_bytes = 0
+    start = time.perf_counter()
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(render_file, source, output, scale, budget, enhancement): (source, output)
+                   for source, output in jobs}
+
+        for future in concurrent.futures.as_completed(futures):
+            source, output = futures[future]
+            entry = {'source': source, 'options': options}
+
+            try:
+                total_bytes += future.result()
+            except Exception as e:
+                error = f'{type(e).__name__}: {e}'
+                print(f'Failed: {source}: {error}')
+                failed += 1
+                entry['status'] = 'failed'
+                entry['error'] = error
+            else:
+                done += 1
+                entry['status'] = 'done'
+                entry['mtime'] = os.path.getmtime(source)
+                entry['sha1'] = file_hash(source) if check == 'hash' else None
+
+            manifest.update(output, entry)
+
+    elapsed = time.perf_counter() - start
+    rate = elapsed if elapsed > 0 else float('inf')
+    print(f'Rendered {done} files, {failed} failed in {elapsed:.1f} s: '
+          f'{done / rate:.2f} files/s, {total_bytes / rate / 2**20:.2f} MB/s')
+
+    return failed
+
+
+def _parse_size(text):
+    """Parse memory size like 512M or 2G into bytes"""
+
+    units = {'K': 2**10, 'M': 2**20, 'G': 2**30}
+    text = text.strip().upper()
+
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def add_parser(subparsers):
+    """Register the render command"""
+
+    parser = subparsers.add_parser('render', help='render RLI files to images')
+    parser.add_argument('sources', nargs='+', help='RLI files, directories or glob patterns')
+    parser.add_argument('-o', '--output', default='.', help='output directory')
+    parser.add_argument('-f', '--format', choices=FORMATS, default='png', help='image format')
+    parser.add_argument('-s', '--scale', type=int, default=1, help='downscale factor for quick-looks')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='number of worker processes')
+    parser.add_argument('-m', '--memory', type=_parse_size, default=None,
+                        help='memory budget per worker for the scene data, e.g. 512M or 2G')
+    parser.add_argument('-c', '--check', choices=('mtime', 'hash'), default='mtime',
+                        help='how to detect up to date outputs')
+    parser.add_argument('-p', '--params', type=enhance.load_params, default=None,
+                        help='enhancement params file written by the tune command')
+    parser.set_defaults(func=_main)
+
+
+def _main(args):
+    try:
+        failed = render(args.sources, args.output, args.format, args.scale,
+                        args.jobs, args.memory, args.check, args.params)
+    except (FileNotFoundError, ValueError) as e:
+        print(f'Error: {e}')
+        return 2
+
+    return 1 if failed else 0
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 
+import concurrent.futures
 import ctypes
 import io
 import itertools
@@ -12,8 +13,8 @@ import skimage
 import skimage.io
 from skimage.util.dtype import img_as_float
 
-from rlview import tile
-import rlview
+from rlview import coregister, enhance
+
 
 
 class SystemTime(ctypes.Structure):
@@ -155,23 +156,52 @@ class TRLIStrHeader(ctypes.Structure):
                 ("WH", ctypes.c_double),
                 ("reserved", ctypes.c_char * 119)]
 
+# Bytes of raw lines decoded at once by RLIFile.load()
+LOAD_CHUNK_SIZE = 16 * 2**20
+
 
 class RLIFile():
     """Common operations with RLI file"""
 
+    # Params for toimg(), see enhance.tune()
+    enhancement = enhance.DEFAULT_ENHANCEMENT
+
+    _data = None
+    _lazy = False
+
     def __init__(self):
         self.header = None
         self.data = None
 
-    def __init__(self, file):
+    def __init__(self, file, lazy=False):
         self.header = None
         self.data = None
         self.path = file
 
+        if lazy:
+            # Only the header, frames are read on demand with frame()
+            # and the whole image on first access to data
+            self.header = read_header(file)
+            self._lazy = True
+            return
+
         with open(file, 'rb') as f:
             self.load(f)
 
 
+    @property
+    def data(self):
+        """Image amplitudes, loaded on first access for lazy files"""
+
+        if self._data is None and self._lazy:
+            with open(self.path, 'rb') as f:
+                self.load(f)
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+
     @property
     def height(self):
         """Image height in points"""
@@ -204,6 +234,84 @@ class RLIFile():
         else:
             raise ValueError
 
+    @property
+    def line_size(self):
+        """Line size in bytes, including line header"""
+        return ctypes.sizeof(TRLIStrHeader) + self.point_size * self.width
+
+    def _decode_lines(self, buf):
+        """Decode whole lines from buf into line headers and amplitudes"""
+
+        header_size = ctypes.sizeof(TRLIStrHeader)
+        count = len(buf) // self.line_size
+
+        lines = np.frombuffer(buf, dtype=np.uint8, count=count * self.line_size)
+        lines = lines.reshape(count, self.line_size)
+
+        headers = [TRLIStrHeader.from_buffer_copy(line) for line in lines[:, :header_size]]
+        points = np.ascontiguousarray(lines[:, header_size:]).view('<f4').astype(float)
+
+        if self.header.RLIFileParams.type == 3:
+            points = np.hypot(points[:, 0::2], points[:, 1::2])
+
+        return headers, points
+
+    @property
+    def frame_height(self):
+        """Frame height in lines"""
+
+        params = self.header.RLIFileParams
+
+        if params.cadrHeight > 0:
+            return min(params.cadrHeight, self.height)
+        if params.frames > 0:
+            return -(-self.height // params.frames)
+        return self.height
+
+    @property
+    def frame_count(self):
+        """Number of frames in the file"""
+
+        if not self.height:
+            return 0
+        return -(-self.height // self.frame_height)
+
+    def frame_lines(self, k):
+        """Range of lines of frame k"""
+
+        if not 0 <= k < self.frame_count:
+            raise IndexError(f'Frame {k} out of range 0..{self.frame_count - 1}')
+
+        start = k * self.frame_height
+        return range(start, min(start + self.frame_height, self.height))
+
+    def frame(self, k):
+        """Amplitudes of frame k, read from the file without loading the rest"""
+
+        lines = self.frame_lines(k)
+
+        with open(self.path, 'rb') as f:
+            f.seek(ctypes.sizeof(Header) + lines.start * self.line_size, io.SEEK_SET)
+            buf = f.read(len(lines) * self.line_size)
+
+        return self._decode_lines(buf)[1]
+
+    def iter_frames(self):
+        """Yield (k, data) for every frame"""
+
+        for k in range(self.frame_count):
+            yield k, self.frame(k)
+
+    def map_frames(self, func, workers=None):
+        """Apply func to every frame in a process pool, returns the results in frame order
+
+        Every worker reads its own frame, func must be picklable.
+        """
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(_map_frame, itertools.repeat(self.path),
+                                 range(self.frame_count), itertools.repeat(func)))
+
 
     def _get_max_value(self, file):
         file.seek(ctypes.sizeof(self.header), io.SEEK_SET)
@@ -235,30 +343,37 @@ class RLIFile():
         
         file.seek(0, io.SEEK_SET)
         self.header = Header.from_buffer_copy(file.read(ctypes.sizeof(Header)))
-        self.data = []
-        
-        line_data_size = self.point_size * self.width
+        self.data = np.empty((self.height, self.width))
 
-        for _ in range(self.height):
-            file.seek(ctypes.sizeof(TRLIStrHeader), io.SEEK_CUR)
-            line = struct.iter_unpack(self._point_type, file.read(line_data_size))
-            line = list(itertools.chain.from_iterable(line))
+        # Decode in chunks so the raw file is never held in memory at once
+        chunk_lines = max(1, LOAD_CHUNK_SIZE // self.line_size)
+        lines = 0
 
-            if len(line) != self.width:
-                continue
+        while lines < self.height:
+            buf = file.read(min(chunk_lines, self.height - lines) * self.line_size)
+            count = len(buf) // self.line_size
 
-            if self.header.RLIFileParams.type == 3:
-                line = amp_modulus(line)
+            if not count:
+                break
 
-            self.data.append(line)
-        
-        self.data = np.array(self.data)
+            self.data[lines:lines + count] = self._decode_lines(buf)[1]
+            lines += count
+
+        self.data = self.data[:lines]
 
-    def add(self, path):
+    def add(self, path, align=False):
         print(f'Add {path}')
 
         file2 = RLIFile(path)
 
+        if align:
+            aligned, shift = coregister.align(self.data, file2.data)
+            print(f'Shift: dy={shift[0]:.2f}, dx={shift[1]:.2f}')
+            # Only the overlap has data from both scenes
+            window = coregister.overlap(aligned.shape, shift)
+            self.data = np.add(self.data[window], aligned[window])
+            return
+
         width = self.data.shape[0] if self.data.shape[0] < file2.data.shape[0] else file2.data.shape[0]
         height = self.data.shape[1] if self.data.shape[1] < file2.data.shape[1] else file2.data.shape[1]
 
@@ -270,20 +385,19 @@ class RLIFile():
 
         self.data = np.add(data1, data2)
 
-    def toimg(self,):
+    def toimg(self, enhancement=None):
         print(f'Convert to img: {self.path}')
 
         img = img_as_float(self.data)
-
-        p_start_val = 0.1
-        p_end_val = 98.7
-        p_start, p_end = np.percentile(img, (p_start_val, p_end_val))
-        img = skimage.exposure.rescale_intensity(img, in_range=(p_start, p_end))
+        img = enhance.enhance(img, enhancement or self.enhancement)
 
         return img
 
 
 
+def _map_frame(path, k, func):
+    return func(RLIFile(path, lazy=True).frame(k))
+
 def read_header(path):
     with open(path, 'rb') as f:
         f.seek(0, io.SEEK_SET)
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+
+"""Decoded RLI scenes shared between processes
+
+A scene is decoded once and published into a shared memory block:
+
+    with shared.publish(rli_file.RLIFile(path)) as scene:
+        with concurrent.futures.ProcessPoolExecutor() as pool:
+            list(pool.map(worker, [scene] * n))
+
+Handles are reference counted, the block is removed when the last handle
+is closed or garbage collected. Handles pickle as the block name, so they
+can be passed to pool workers (each task gets its own handle, released
+when the task drops it) or attached by name with attach(). Workers killed
+while holding a handle (multiprocessing.Pool.terminate(), which the Pool
+context manager calls) never release it; the block is then removed by the
+resource tracker when the publishing process exits.
+"""
+
+import contextlib
+import ctypes
+import multiprocessing
+import os
+import sys
+import tempfile
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from rlview import rli_file
+
+
+class TSharedScene(ctypes.Structure):
+    """Layout of the shared block start, followed by the file header and data"""
+    _pack_ = 1
+    _fields_ = [("refcount", ctypes.c_int64),
+                ("creator_pid", ctypes.c_int64),
+                ("rows", ctypes.c_int64),
+                ("cols", ctypes.c_int64),
+                ("dtype", ctypes.c_char * 8),
+                ("path", ctypes.c_char * 1024)]
+
+
+_DATA_OFFSET = ctypes.sizeof(TSharedScene) + ctypes.sizeof(rli_file.Header)
+
+
+@contextlib.contextmanager
+def _locked(name):
+    """Inter-process lock guarding the reference counter of a block"""
+
+    with open(os.path.join(tempfile.gettempdir(), f'{name}.lock'), 'a+b') as f:
+        if sys.platform == 'win32':
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _shares_tracker(creator_pid):
+    """Whether this process uses the resource tracker of the block creator
+
+    Children of the creator (pool workers) inherit its tracker.
+    """
+    if os.getpid() == creator_pid:
+        return True
+
+    parent = multiprocessing.parent_process()
+    return parent is not None and parent.pid == creator_pid
+
+
+def _release_tracking(shm, creator_pid):
+    """Undo the registration SharedMemory() made when opening a block"""
+
+    if os.name == 'posix' and not _shares_tracker(creator_pid):
+        # Otherwise the tracker of an unrelated attaching process unlinks
+        # the block when that process exits. In the creator's own tracker
+        # the registration is the creator's one and must stay.
+        resource_tracker.unregister(shm._name, 'shared_memory')
+
+
+def _unlink_block(shm):
+    """Remove a block, whichever process opened it"""
+
+    if os.name == 'posix':
+        # unlink() unregisters the block, so it must be known to our tracker
+        resource_tracker.register(shm._name, 'shared_memory')
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+
+
+class SharedRLIFile(rli_file.RLIFile):
+    """RLI file whose data lives in shared memory, see publish() and attach()"""
+
+    def __init__(self, shm):
+        self._shm = shm
+        self.name = shm.name
+
+        meta = TSharedScene.from_buffer_copy(shm.buf)
+        self.path = meta.path.decode('utf-8')
+        self.header = rli_file.Header.from_buffer_copy(shm.buf, ctypes.sizeof(TSharedScene))
+        self.data = np.ndarray((meta.rows, meta.cols), dtype=meta.dtype.decode('ascii'),
+                               buffer=shm.buf, offset=_DATA_OFFSET)
+        # Writes would be seen by every process
+        self.data.flags.writeable = False
+
+    def __reduce__(self):
+        return attach, (self.name,)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+    @property
+    def refcount(self):
+        """Number of open handles to the block"""
+        return TSharedScene.from_buffer_copy(self._shm.buf).refcount
+
+    def close(self):
+        """Release the handle, the last one removes the block"""
+
+        if getattr(self, '_shm', None) is None:
+            return
+
+        # Views into the buffer must go before it can be unmapped
+        self.data = None
+        shm, self._shm = self._shm, None
+
+        with _locked(self.name):
+            meta = TSharedScene.from_buffer(shm.buf)
+            meta.refcount -= 1
+            refcount = meta.refcount
+            del meta
+            # Views kept by the caller hold the mapping until they are gone
+            with contextlib.suppress(BufferError):
+                shm.close()
+
+            if refcount <= 0:
+                _unlink_block(shm)
+
+        if refcount <= 0:
+            with contextlib.suppress(OSError):
+                os.remove(os.path.join(tempfile.gettempdir(), f'{self.name}.lock'))
+
+
+def publish(file: rli_file.RLIFile):
+    """Copy a decoded file into a new shared memory block
+
+    Returns the first handle to the block.
+    """
+
+    data = np.ascontiguousarray(file.data)
+    if data.ndim != 2:
+        raise ValueError(f'Expected 2D data, got shape {data.shape}')
+
+    shm = shared_memory.SharedMemory(create=True, size=_DATA_OFFSET + data.nbytes)
+
+    meta = TSharedScene.from_buffer(shm.buf)
+    meta.refcount = 1
+    meta.creator_pid = os.getpid()
+    meta.rows, meta.cols = data.shape
+    meta.dtype = data.dtype.str.encode('ascii')
+    meta.path = os.fspath(file.path).encode('utf-8')
+    del meta
+
+    header = bytes(file.header)
+    shm.buf[ctypes.sizeof(TSharedScene):_DATA_OFFSET] = header
+    np.ndarray(data.shape, dtype=data.dtype, buffer=shm.buf, offset=_DATA_OFFSET)[:] = data
+
+    return SharedRLIFile(shm)
+
+
+def publish_file(path):
+    """Decode an RLI file and publish it, see publish()"""
+    return publish(rli_file.RLIFile(path))
+
+
+def attach(name):
+    """Open a new handle to a published block by its name
+
+    Raises FileNotFoundError if the block is already released.
+    """
+
+    with _locked(name):
+        shm = shared_memory.SharedMemory(name)
+
+        meta = TSharedScene.from_buffer(shm.buf)
+        creator_pid = meta.creator_pid
+        released = meta.refcount <= 0
+        if not released:
+            meta.refcount += 1
+        del meta
+
+        _release_tracking(shm, creator_pid)
+
+        if released:
+            shm.close()
+            raise FileNotFoundError(f'Shared scene {name} is already released')
+
+    return SharedRLIFile(shm)